@@ -1,13 +1,23 @@
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, Request, UploadFile, File, Query, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel, Field, ValidationError
 import torch
 import torchvision
-import torchvision.transforms as transforms
 from PIL import Image
+import asyncio
 import io
+import re
 import time
 import logging
+from typing import Optional
+from pathlib import Path
+
+from tta import TTA_MODES, build_views, aggregate_logits, topk_predictions
+from response_format import IMAGENET_CLASSES, TIMING_HEADERS, negotiate, build_response
+from placement import PlacementAdvisor
 
 app = FastAPI()
 
@@ -28,8 +38,28 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=list(TIMING_HEADERS),
 )
 
+# サーバー/WASM の振り分け判断用にレイテンシとキュー深さを記録する
+advisor = PlacementAdvisor({mode: views for mode, (_, views) in TTA_MODES.items()})
+
+@app.middleware("http")
+async def track_queue_depth(request: Request, call_next):
+    """推論リクエストを受け付けた時点から完了までをキュー深さとして数える
+
+    アップロードの受信中や推論ロック待ちのリクエストも含めるため、ハンドラではなく
+    ミドルウェアで数える。
+    """
+    mode = request.query_params.get("tta", "none")
+    if request.method != "POST" or request.url.path != "/api/predict-server" or mode not in TTA_MODES:
+        return await call_next(request)
+    advisor.request_started(mode)
+    try:
+        return await call_next(request)
+    finally:
+        advisor.request_finished(mode)
+
 # サーバーサイド推論用のモデルロード (比較用: 遅いAPI)
 model = torchvision.models.resnet18(pretrained=True)
 model.eval()
@@ -47,55 +77,156 @@ def _warmup_model(model, runs=5):
             logging.info(f" Warmup {i+1}/{runs}: {(t1-t0)*1000:.2f} ms")
     logging.info("Warm-up complete")
 
-# 画像前処理
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),  # クロップせずに強制リサイズ（JSに合わせる）
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-])
+# torch のスレッドは1本なので推論は1件ずつ。イベントループを塞がないようスレッドプールで実行する
+_inference_lock = asyncio.Lock()
 
-@app.post("/api/predict-server")
-async def predict_server(file: UploadFile = File(...)):
-    """サーバーサイドで推論を行うAPI (通信ラグあり)"""
-    req_start = time.time()
+def _run_inference(image_data, tta, keep_aspect):
+    """画像デコード・前処理・推論を行い (softmax 確率, ビュー数, 前処理ms, 推論ms, 合計ms) を返す"""
+    start = time.time()
 
     # 画像読み込み
-    t0 = time.time()
-    image_data = await file.read()
     image = Image.open(io.BytesIO(image_data)).convert("RGB")
-    t1 = time.time()
 
-    # 前処理
+    # 前処理 (全ビューをまとめてバッチ化)
     p0 = time.time()
-    input_tensor = transform(image).unsqueeze(0)
+    input_tensor = build_views(image, tta, keep_aspect)
     p1 = time.time()
 
-    # 推論
+    # 推論 (バッチで1回)
     inf0 = time.time()
     with torch.no_grad():
         output = model(input_tensor)
     inf1 = time.time()
 
-    # 結果処理
-    probabilities = torch.nn.functional.softmax(output[0], dim=0)
-    top1_prob, top1_id = torch.topk(probabilities, 1)
+    # 結果処理 (ビュー間で logits を平均)
+    probabilities = torch.nn.functional.softmax(aggregate_logits(output), dim=0)
+    end = time.time()
 
-    req_end = time.time()
+    return probabilities, int(input_tensor.shape[0]), (p1 - p0) * 1000, (inf1 - inf0) * 1000, (end - start) * 1000
 
-    preprocess_ms = (p1 - p0) * 1000
-    inference_ms = (inf1 - inf0) * 1000
-    total_ms = (req_end - req_start) * 1000
+@app.post("/api/predict-server")
+async def predict_server(
+    file: UploadFile = File(...),
+    tta: str = Query("none", description="TTAモード: " + ", ".join(TTA_MODES)),
+    keep_aspect: bool = Query(False, description="アスペクト比を維持して短辺をリサイズする"),
+    topk: int = Query(1, ge=1, le=1000),
+    probs: str = Query("topk", description="topk: 上位k件のみ / full: 全クラスの softmax も返す"),
+    accept: str = Header("application/json"),
+):
+    """サーバーサイドで推論を行うAPI (通信ラグあり)
+
+    tta を指定すると複数ビューを1回の前処理で生成し、1回のバッチ推論で
+    logits を平均して返す。
+    Accept ヘッダで application/octet-stream / application/x-msgpack を指定すると
+    コンパクトなバイナリ形式で返す (形式は response_format.py を参照)。
+    """
+    if tta not in TTA_MODES:
+        raise HTTPException(status_code=400, detail=f"tta must be one of {list(TTA_MODES)}")
+    if probs not in ("topk", "full"):
+        raise HTTPException(status_code=400, detail="probs must be 'topk' or 'full'")
+    fmt = negotiate(accept)
+    if fmt is None:
+        raise HTTPException(
+            status_code=406,
+            detail="supported types: application/json, application/octet-stream, application/x-msgpack",
+        )
 
-    logging.info(f"Request processed: preprocess={preprocess_ms:.2f}ms inference={inference_ms:.2f}ms total={total_ms:.2f}ms")
+    req_start = time.time()
+    image_data = await file.read()
 
-    return {
-        "class_id": int(top1_id[0]),
-        "probability": float(top1_prob[0]),
+    async with _inference_lock:
+        probabilities, num_views, preprocess_ms, inference_ms, service_ms = await run_in_threadpool(
+            _run_inference, image_data, tta, keep_aspect
+        )
+    # キュー待ちを除いた処理時間をモード別に記録する
+    advisor.record_server(tta, preprocess_ms, inference_ms, service_ms)
+
+    top = topk_predictions(probabilities, topk)
+    total_ms = (time.time() - req_start) * 1000
+
+    logging.info(f"Request processed: format={fmt} tta={tta} views={num_views} preprocess={preprocess_ms:.2f}ms inference={inference_ms:.2f}ms service={service_ms:.2f}ms total={total_ms:.2f}ms")
+
+    result = {
+        "class_id": top[0][0],
+        "probability": top[0][1],
+        "label": IMAGENET_CLASSES[top[0][0]],
+        "tta": tta,
+        "keep_aspect": keep_aspect,
+        "num_views": num_views,
         "latency_ms": total_ms,
         "preprocess_ms": preprocess_ms,
         "inference_ms": inference_ms,
         "mode": "Server-side (Python)"
     }
+    return build_response(fmt, result, top, probabilities.numpy() if probs == "full" else None)
+
+# --- 推論場所 (サーバー / WASM) のアドバイザ ---
+# 報告値の上限 (ms)。これを超える値や NaN/Infinity は計測ミスとして受け付けない
+MAX_REPORTED_MS = 60_000
+
+class ClientReport(BaseModel):
+    """クライアントが報告する計測値 (ms)"""
+    # main.js の DEVICE_CLASS と同じ "<コア数>core-<メモリGB>gb" 形式 (不明な値は "?")
+    device_class: str = Field(pattern=r"^(\d{1,3}|\?)core-(\d{1,3}(\.\d{1,2})?|\?)gb$")
+    # WASM 推論 (前処理込み) の所要時間
+    wasm_ms: Optional[float] = Field(None, ge=0, le=MAX_REPORTED_MS, allow_inf_nan=False)
+    # サーバー推論の往復時間からサーバー処理時間を引いた通信オーバーヘッド
+    network_ms: Optional[float] = Field(None, ge=0, le=MAX_REPORTED_MS, allow_inf_nan=False)
+
+@app.post("/api/placement/report", openapi_extra={
+    "requestBody": {"content": {"application/json": {"schema": ClientReport.model_json_schema()}}, "required": True},
+})
+async def placement_report(request: Request):
+    """クライアント側の WASM 推論時間・通信オーバーヘッドを記録する
+
+    標準の body 解析は NaN/Infinity を受け付け、その 422 エラーの本文化にも失敗するため、
+    pydantic の厳密な JSON パーサで検証する。
+    """
+    try:
+        report = ClientReport.model_validate_json(await request.body())
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_input=False, include_url=False))
+    advisor.report_client(report.device_class, report.wasm_ms, report.network_ms)
+    return {"ok": True}
+
+@app.get("/api/placement")
+async def placement(
+    device_class: str = Query("unknown", max_length=64),
+    rtt_ms: Optional[float] = Query(
+        None, ge=0, le=MAX_REPORTED_MS, allow_inf_nan=False,
+        description="クライアントが測った通信時間 (省略時は報告値の中央値)",
+    ),
+    tta: str = Query("none", description="サーバーで実行する場合の TTA モード"),
+):
+    """ローカル (WASM) とリモート (サーバー) のどちらで推論すべきかを期待レイテンシ付きで返す"""
+    if tta not in TTA_MODES:
+        raise HTTPException(status_code=400, detail=f"tta must be one of {list(TTA_MODES)}")
+    return advisor.advise(device_class, rtt_ms, tta)
+
+# --- ブラウザ用モデルバンドル (scripts/export_browser_bundle.py で生成) ---
+BUNDLE_DIR = Path("models") / "bundle"
+_SHA256_RE = re.compile(r"[0-9a-f]{64}")
+_BUNDLE_NAME_RE = re.compile(r"[A-Za-z0-9._-]+")
+
+@app.get("/models/bundle/blobs/{digest}")
+async def bundle_blob(digest: str):
+    """内容ハッシュ名のチャンク/グラフを返す (内容が変わらないので長期キャッシュ可)"""
+    path = BUNDLE_DIR / "blobs" / digest
+    if not _SHA256_RE.fullmatch(digest) or not path.is_file():
+        raise HTTPException(status_code=404, detail="blob not found")
+    return FileResponse(
+        path,
+        media_type="application/octet-stream",
+        headers={"Cache-Control": "public, max-age=31536000, immutable", "ETag": f'"{digest}"'},
+    )
+
+@app.get("/models/bundle/{name}/manifest.json")
+async def bundle_manifest(name: str):
+    """マニフェストは版の切り替えで変わるので毎回再検証させる"""
+    path = BUNDLE_DIR / name / "manifest.json"
+    if not _BUNDLE_NAME_RE.fullmatch(name) or name.startswith(".") or not path.is_file():
+        raise HTTPException(status_code=404, detail="bundle not found")
+    return FileResponse(path, media_type="application/json", headers={"Cache-Control": "no-cache"})
 
 # 静的ファイル (HTML/JS/Model) の配信
 # modelsディレクトリも配信して、ブラウザがfetchできるようにする
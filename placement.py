@@ -0,0 +1,172 @@
+"""
+サーバー推論とクライアント (WASM) 推論のどちらで実行すべきかを判断するアドバイザ
+
+サーバー側は TTA モードごとの処理時間 (ステージ別) と、受け付けてまだ完了していない
+リクエスト数 (キュー深さ) を、クライアント側はデバイスクラスごとに報告された WASM 推論時間と
+通信オーバーヘッドを直近の一定時間だけ保持し、それぞれの期待レイテンシを見積もる。
+"""
+import statistics
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict, deque
+
+# 直近この秒数・件数のサンプルだけを使う
+WINDOW_S = 300.0
+MAX_SAMPLES = 100
+# 保持するデバイスクラス数の上限 (超えたら最も長く報告のないものから捨てる)
+MAX_DEVICE_CLASSES = 256
+
+
+class _Samples:
+    """時刻付きの直近サンプル (古いものは読み出し時に捨てる)"""
+
+    def __init__(self):
+        self._items = deque(maxlen=MAX_SAMPLES)
+
+    def add(self, value: float):
+        self._items.append((time.monotonic(), float(value)))
+
+    def median(self):
+        cutoff = time.monotonic() - WINDOW_S
+        while self._items and self._items[0][0] < cutoff:
+            self._items.popleft()
+        if not self._items:
+            return None
+        return statistics.median(v for _, v in self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class _DeviceTable:
+    """デバイスクラス -> サンプル の表 (件数上限つき LRU、期限切れのクラスは走査時に削除)"""
+
+    def __init__(self):
+        self._classes = OrderedDict()
+
+    def add(self, device_class: str, value: float):
+        samples = self._classes.get(device_class)
+        if samples is None:
+            samples = self._classes[device_class] = _Samples()
+            while len(self._classes) > MAX_DEVICE_CLASSES:
+                self._classes.popitem(last=False)
+        self._classes.move_to_end(device_class)
+        samples.add(value)
+
+    def count(self, device_class: str) -> int:
+        samples = self._classes.get(device_class)
+        return len(samples) if samples is not None else 0
+
+    def median(self, device_class: str):
+        """デバイスクラスのサンプルがなければ全デバイスの中央値で代用する"""
+        samples = self._classes.get(device_class)
+        value = samples.median() if samples is not None else None
+        if value is not None:
+            return value
+
+        medians = []
+        for name, s in list(self._classes.items()):
+            m = s.median()
+            if m is None:
+                del self._classes[name]
+            else:
+                medians.append(m)
+        return statistics.median(medians) if medians else None
+
+
+class PlacementAdvisor:
+    def __init__(self, views_per_mode: dict):
+        """views_per_mode は TTA モード -> 1リクエストあたりのビュー数 (tta.TTA_MODES から作る)"""
+        self._views = views_per_mode
+        self._lock = threading.Lock()
+        self._in_flight = Counter()            # tta mode -> 受け付け済みで未完了のリクエスト数
+        self._server = defaultdict(_Samples)   # (tta mode, stage) -> samples (preprocess / inference / total)
+        self._wasm = _DeviceTable()            # WASM 推論 (前処理込み) ms
+        self._network = _DeviceTable()         # サーバー呼び出しの通信オーバーヘッド ms
+
+    # --- サーバー側の計測 ---
+    def request_started(self, mode: str):
+        """リクエストを受け付けた時点で呼ぶ (推論待ちのリクエストもキュー深さに含める)"""
+        with self._lock:
+            self._in_flight[mode] += 1
+
+    def request_finished(self, mode: str):
+        with self._lock:
+            self._in_flight[mode] -= 1
+            if self._in_flight[mode] <= 0:
+                del self._in_flight[mode]
+
+    def record_server(self, mode: str, preprocess_ms, inference_ms, total_ms):
+        """推論1回分 (待ち時間を除く) のステージ別レイテンシを記録する"""
+        with self._lock:
+            for stage, value in (("preprocess", preprocess_ms), ("inference", inference_ms), ("total", total_ms)):
+                self._server[(mode, stage)].add(value)
+
+    def _service_ms(self, mode: str):
+        """モードごとの処理時間の中央値
+
+        そのモードの実績がなければ、実績のあるモードの 1ビューあたりの処理時間 × ビュー数 で見積もる
+        (none しか来ていないサーバーでも ten_crop をおよそ 10 倍と見なす)。
+        """
+        value = self._server[(mode, "total")].median()
+        if value is None:
+            per_view = []
+            for (m, stage), s in list(self._server.items()):
+                median = s.median() if stage == "total" else None
+                if median is not None:
+                    per_view.append(median / self._views[m])
+            value = statistics.median(per_view) * self._views[mode] if per_view else None
+        return value
+
+    # --- クライアントからの報告 ---
+    def report_client(self, device_class: str, wasm_ms=None, network_ms=None):
+        with self._lock:
+            if wasm_ms is not None:
+                self._wasm.add(device_class, wasm_ms)
+            if network_ms is not None:
+                self._network.add(device_class, network_ms)
+
+    def advise(self, device_class: str, rtt_ms=None, mode: str = "none") -> dict:
+        """ローカル (wasm) とリモート (server) の期待レイテンシを見積もり、速い方を勧める
+
+        サーバーは推論を1件ずつ直列に処理するため、待ち時間は処理中・待機中の
+        各リクエストのモード別処理時間の合計 + 自分の処理時間 で見積もる。
+        通信時間が rtt_ms でも報告値でも分からない場合は、0 と見なしてサーバーに
+        有利な見積もりにならないよう server の期待値を None とし、missing に挙げる。
+        """
+        with self._lock:
+            queue_depth = sum(self._in_flight.values())
+            service_ms = self._service_ms(mode)
+            wasm_ms = self._wasm.median(device_class)
+            if rtt_ms is None:
+                rtt_ms = self._network.median(device_class)
+
+            missing = [name for name, value in (("server_ms", service_ms), ("network_ms", rtt_ms), ("wasm_ms", wasm_ms))
+                       if value is None]
+
+            server_ms = None
+            if service_ms is not None and rtt_ms is not None:
+                queued_ms = sum(n * self._service_ms(m) for m, n in self._in_flight.items())
+                server_ms = queued_ms + service_ms + rtt_ms
+
+            if wasm_ms is None:
+                # WASM の実績がどのデバイスにもなければ、サーバーが見積もれない場合だけローカルを試させる
+                recommendation = "wasm" if server_ms is None else "server"
+            elif server_ms is None:
+                recommendation = "wasm"
+            else:
+                recommendation = "wasm" if wasm_ms <= server_ms else "server"
+
+            return {
+                "recommendation": recommendation,
+                "expected_ms": {"server": server_ms, "wasm": wasm_ms},
+                "queue_depth": queue_depth,
+                "tta": mode,
+                "server_stages_ms": {
+                    stage: self._server[(mode, stage)].median() for stage in ("preprocess", "inference", "total")
+                },
+                "network_ms": rtt_ms,
+                "missing": missing,
+                "device_class": device_class,
+                "wasm_samples": self._wasm.count(device_class),
+            }
@@ -0,0 +1,125 @@
+"""
+推論結果のレスポンス形式 (JSON / バイナリ / MessagePack) のネゴシエーションとエンコード
+
+JSON が既定。高QPSのクライアントは Accept ヘッダで以下を指定できる:
+  - application/octet-stream : 固定レイアウトのバイナリ (下記)
+  - application/x-msgpack    : MessagePack (確率ベクトルは float16 の bin)
+
+バイナリのレイアウト (リトルエンディアン):
+  header  : magic b"WMLP", version u8, kind u8 (0=topk, 1=full), count u16
+  kind=0  : class_id u16[count], prob f16[count], ラベル (UTF-8, "\\n" 区切り, 末尾まで)
+  kind=1  : prob f16[count] (全クラスの softmax)
+計測値は X-Latency-Ms などのレスポンスヘッダで返す。
+"""
+import json
+import struct
+from pathlib import Path
+
+import numpy as np
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MAGIC = b"WMLP"
+VERSION = 1
+KIND_TOPK = 0
+KIND_FULL = 1
+
+JSON_TYPE = "application/json"
+BINARY_TYPE = "application/octet-stream"
+MSGPACK_TYPES = ("application/x-msgpack", "application/msgpack", "application/vnd.msgpack")
+
+# ImageNet 1000 クラスのラベル (static/ に置いてブラウザからも同じものを使う)
+IMAGENET_CLASSES = json.loads(
+    (Path(__file__).resolve().parent / "static" / "imagenet_classes.json").read_text(encoding="utf-8")
+)
+
+
+def negotiate(accept: str):
+    """Accept ヘッダから返却形式 ("json" / "binary" / "msgpack") を決める
+
+    q 値の大きいものを優先し、対応していない形式は無視する。
+    ヘッダがなければ JSON、対応する形式が1つもなければ None (406 を返す) とする。
+    """
+    if not (accept or "").strip():
+        return "json"
+    candidates = []
+    for order, part in enumerate(accept.split(",")):
+        fields = [f.strip() for f in part.split(";")]
+        media_type = fields[0].lower()
+        q = 1.0
+        for param in fields[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if media_type == BINARY_TYPE:
+            fmt = "binary"
+        elif media_type in MSGPACK_TYPES and msgpack is not None:
+            fmt = "msgpack"
+        elif media_type in (JSON_TYPE, "application/*", "*/*"):
+            fmt = "json"
+        else:
+            continue
+        if q > 0:
+            candidates.append((-q, order, fmt))
+    return min(candidates)[2] if candidates else None
+
+
+# バイナリ形式で計測値を返すヘッダ (クロスオリジンでも読めるよう CORS で公開する)
+TIMING_HEADERS = ("X-Class-Id", "X-Latency-Ms", "X-Preprocess-Ms", "X-Inference-Ms")
+
+
+def _timing_headers(result: dict) -> dict:
+    return {
+        "X-Class-Id": str(result["class_id"]),
+        "X-Latency-Ms": f"{result['latency_ms']:.3f}",
+        "X-Preprocess-Ms": f"{result['preprocess_ms']:.3f}",
+        "X-Inference-Ms": f"{result['inference_ms']:.3f}",
+    }
+
+
+def encode_binary(top, probabilities=None) -> bytes:
+    """top-k 表 (probabilities=None のとき) または全クラスの float16 softmax をバイナリ化する"""
+    if probabilities is not None:
+        probs = np.asarray(probabilities, dtype="<f2")
+        return struct.pack("<4sBBH", MAGIC, VERSION, KIND_FULL, probs.size) + probs.tobytes()
+
+    ids = np.array([i for i, _ in top], dtype="<u2")
+    probs = np.array([p for _, p in top], dtype="<f2")
+    labels = "\n".join(IMAGENET_CLASSES[i] for i, _ in top).encode("utf-8")
+    return struct.pack("<4sBBH", MAGIC, VERSION, KIND_TOPK, ids.size) + ids.tobytes() + probs.tobytes() + labels
+
+
+def build_response(fmt: str, result: dict, top, probabilities=None) -> Response:
+    """推論結果を指定形式のレスポンスにする
+
+    result は JSON レスポンスと同じ計測値などの dict、top は [(class_id, prob), ...]、
+    probabilities は full 指定時の全クラス softmax (numpy 配列)。
+    """
+    # 形式は Accept で変わるのでキャッシュに区別させる
+    headers = {"Vary": "Accept"}
+
+    if fmt == "binary":
+        return Response(
+            encode_binary(top, probabilities),
+            media_type=BINARY_TYPE,
+            headers={**headers, **_timing_headers(result)},
+        )
+
+    top_k = [{"class_id": i, "probability": p, "label": IMAGENET_CLASSES[i]} for i, p in top]
+
+    if fmt == "msgpack":
+        payload = dict(result, top_k=top_k)
+        if probabilities is not None:
+            payload["probabilities_f16"] = np.asarray(probabilities, dtype="<f2").tobytes()
+        return Response(msgpack.packb(payload, use_bin_type=True), media_type=MSGPACK_TYPES[0], headers=headers)
+
+    payload = dict(result, top_k=top_k)
+    if probabilities is not None:
+        payload["probabilities"] = [round(float(p), 6) for p in probabilities]
+    return JSONResponse(payload, headers=headers)
@@ -0,0 +1,95 @@
+"""
+Benchmark cost and accuracy of each TTA mode used by `/api/predict-server`.
+Usage:
+  python scripts/benchmark_tta.py image1.jpg [image2.jpg ...] [--labels labels.csv] [--keep-aspect] [--runs N]
+
+This script:
+ - Loads PyTorch ResNet18 and the same TTA preprocessing as `app.py` (`tta.py`)
+ - For every mode, builds all views in one step and classifies them in one batched forward pass
+ - Reports views / preprocess ms / inference ms per image for each mode
+ - With `--labels` (CSV lines: `filename,class_id`), reports top-1 / top-5 accuracy per mode
+ - Without labels, reports top-1 agreement with the baseline `none` mode and mean top-1 prob
+"""
+import argparse
+import csv
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torchvision
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from tta import TTA_MODES, build_views, aggregate_logits, topk_predictions  # noqa: E402
+
+
+def load_labels(path):
+    labels = {}
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            if len(row) >= 2 and row[1].strip().isdigit():
+                labels[Path(row[0].strip()).name] = int(row[1])
+    return labels
+
+
+def run_mode(model, images, mode, keep_aspect, runs):
+    pre_ms, inf_ms, preds = [], [], []
+    with torch.no_grad():
+        for img in images:
+            for _ in range(runs):
+                p0 = time.perf_counter()
+                batch = build_views(img, mode, keep_aspect)
+                p1 = time.perf_counter()
+                output = model(batch)
+                p2 = time.perf_counter()
+                pre_ms.append((p1 - p0) * 1000)
+                inf_ms.append((p2 - p1) * 1000)
+            preds.append(topk_predictions(torch.softmax(aggregate_logits(output), dim=0), 5))
+    return float(np.median(pre_ms)), float(np.median(inf_ms)), preds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='+')
+    parser.add_argument('--labels', help='CSV with filename,class_id per line')
+    parser.add_argument('--keep-aspect', action='store_true')
+    parser.add_argument('--runs', type=int, default=3, help='timed runs per image (median is reported)')
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    model = torchvision.models.resnet18(pretrained=True)
+    model.eval()
+    with torch.no_grad():
+        model(torch.randn(1, 3, 224, 224))  # warm-up
+
+    paths = [Path(p) for p in args.images]
+    images = [Image.open(p).convert('RGB') for p in paths]
+    labels = load_labels(args.labels) if args.labels else None
+
+    results = {mode: run_mode(model, images, mode, args.keep_aspect, args.runs) for mode in TTA_MODES}
+    baseline = [p[0][0] for p in results['none'][2]]
+
+    print(f"\nimages={len(images)} keep_aspect={args.keep_aspect} runs={args.runs}")
+    if labels is not None:
+        print(f"{'mode':<10} {'views':>5} {'pre ms':>8} {'inf ms':>8} {'top1':>6} {'top5':>6}")
+    else:
+        print(f"{'mode':<10} {'views':>5} {'pre ms':>8} {'inf ms':>8} {'agree':>6} {'prob':>6}")
+
+    for mode, (pre_ms, inf_ms, preds) in results.items():
+        views = TTA_MODES[mode][1]
+        if labels is not None:
+            scored = [(p, labels[path.name]) for p, path in zip(preds, paths) if path.name in labels]
+            n = max(len(scored), 1)
+            top1 = sum(p[0][0] == y for p, y in scored) / n
+            top5 = sum(y in [c for c, _ in p] for p, y in scored) / n
+            print(f"{mode:<10} {views:>5} {pre_ms:>8.2f} {inf_ms:>8.2f} {top1:>6.3f} {top5:>6.3f}")
+        else:
+            agree = sum(p[0][0] == b for p, b in zip(preds, baseline)) / len(preds)
+            prob = float(np.mean([p[0][1] for p in preds]))
+            print(f"{mode:<10} {views:>5} {pre_ms:>8.2f} {inf_ms:>8.2f} {agree:>6.3f} {prob:>6.3f}")
+
+
+if __name__ == '__main__':
+    main()
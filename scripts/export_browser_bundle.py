@@ -0,0 +1,128 @@
+"""
+ブラウザ向けのモデルバンドル (グラフ + 分割された外部重み + マニフェスト) を生成する
+Usage:
+  python scripts/export_browser_bundle.py [--model models/resnet18.quant.onnx] [--chunk-mb 4]
+
+出力 (models/bundle/):
+  <name>/manifest.json  : グラフ・チャンクの一覧 (ハッシュ, オフセット, サイズ)
+  blobs/<sha256>        : グラフ本体と重みチャンク (内容ハッシュ名なので版をまたいで共有される)
+
+重みは全て1つの外部データ (weights.bin) として扱い、テンソル単位の境界で
+チャンクに詰める。変更のないテンソルだけのチャンクは前の版と同じハッシュになるため、
+ブラウザはキャッシュ済みのチャンクを再利用できる。
+"""
+import argparse
+import hashlib
+import json
+from pathlib import Path
+
+import onnx
+from onnx import numpy_helper
+
+EXTERNAL_DATA_PATH = "weights.bin"
+# これより小さいテンソルはグラフに埋め込んだままにする
+INLINE_THRESHOLD = 1024
+
+
+def _tensor_bytes(tensor):
+    if tensor.HasField("raw_data"):
+        return tensor.raw_data
+    return numpy_helper.to_array(tensor).tobytes()
+
+
+def _save_blob(blobs_dir: Path, data: bytes) -> dict:
+    digest = hashlib.sha256(data).hexdigest()
+    path = blobs_dir / digest
+    if not path.exists():
+        path.write_bytes(data)
+    return {"sha256": digest, "size": len(data)}
+
+
+def _pack_chunks(tensors, chunk_size):
+    """テンソルの bytes 列をテンソル境界でチャンクに詰める (巨大テンソルは単独で分割)"""
+    chunks, current = [], []
+    current_size = 0
+    for data in tensors:
+        if len(data) >= chunk_size:
+            if current:
+                chunks.append(b"".join(current))
+                current, current_size = [], 0
+            chunks.extend(data[i:i + chunk_size] for i in range(0, len(data), chunk_size))
+            continue
+        if current_size + len(data) > chunk_size:
+            chunks.append(b"".join(current))
+            current, current_size = [], 0
+        current.append(data)
+        current_size += len(data)
+    if current:
+        chunks.append(b"".join(current))
+    return chunks
+
+
+def build_bundle(model_path, out_dir, name=None, chunk_size=4 * 1024 * 1024):
+    """ONNX モデルからブラウザ用バンドルを作成し、マニフェストのパスを返す"""
+    model_path = Path(model_path)
+    out_dir = Path(out_dir)
+    name = name or model_path.name.removesuffix(".onnx")
+    blobs_dir = out_dir / "blobs"
+    blobs_dir.mkdir(parents=True, exist_ok=True)
+
+    # 外部データ (.onnx.data) を参照しているモデルもここで全て読み込む
+    model = onnx.load(str(model_path), load_external_data=True)
+
+    # 重みを1本の外部データに並べ、各テンソルをそのオフセットへの参照に置き換える
+    weights, offset = [], 0
+    for tensor in model.graph.initializer:
+        data = _tensor_bytes(tensor)
+        if len(data) < INLINE_THRESHOLD:
+            continue
+        for field in ("raw_data", "float_data", "int32_data", "int64_data", "double_data", "uint64_data"):
+            tensor.ClearField(field)
+        del tensor.external_data[:]
+        tensor.data_location = onnx.TensorProto.EXTERNAL
+        for key, value in (("location", EXTERNAL_DATA_PATH), ("offset", str(offset)), ("length", str(len(data)))):
+            entry = tensor.external_data.add()
+            entry.key, entry.value = key, value
+        weights.append(data)
+        offset += len(data)
+
+    graph = _save_blob(blobs_dir, model.SerializeToString())
+
+    chunks, chunk_offset = [], 0
+    for data in _pack_chunks(weights, chunk_size):
+        entry = _save_blob(blobs_dir, data)
+        entry["offset"] = chunk_offset
+        chunks.append(entry)
+        chunk_offset += len(data)
+
+    manifest = {
+        "name": name,
+        "source": model_path.name,
+        "graph": graph,
+        "external_data": {"path": EXTERNAL_DATA_PATH, "size": offset},
+        "chunks": chunks,
+    }
+    manifest_path = out_dir / name / "manifest.json"
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    manifest_path.write_text(json.dumps(manifest, indent=2))
+    return manifest_path
+
+
+def main():
+    project_root = Path(__file__).resolve().parent.parent
+    parser = argparse.ArgumentParser(description="Build a chunked, content-hashed ONNX bundle for the browser")
+    parser.add_argument("--model", default=str(project_root / "models" / "resnet18.quant.onnx"))
+    parser.add_argument("--out", default=str(project_root / "models" / "bundle"))
+    parser.add_argument("--name", help="bundle name (default: model file name without .onnx)")
+    parser.add_argument("--chunk-mb", type=float, default=4.0)
+    args = parser.parse_args()
+
+    manifest_path = build_bundle(args.model, args.out, args.name, int(args.chunk_mb * 1024 * 1024))
+    manifest = json.loads(manifest_path.read_text())
+    print(f"✅ バンドル作成完了: {manifest_path}")
+    print(f"   グラフ: {manifest['graph']['size'] / 1024:.1f} KB")
+    print(f"   重み: {manifest['external_data']['size'] / 1024 / 1024:.2f} MB ({len(manifest['chunks'])} チャンク)")
+
+
+if __name__ == "__main__":
+    main()
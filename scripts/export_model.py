@@ -4,6 +4,8 @@ import onnx
 from onnxruntime.quantization import quantize_dynamic, QuantType
 from pathlib import Path
 
+from export_browser_bundle import build_bundle
+
 def main():
     print("1. PyTorchモデル(ResNet18)をダウンロード中...")
     model = torchvision.models.resnet18(pretrained=True)
@@ -53,7 +55,11 @@ def main():
         onnx.save(model_onnx, quant_output_path, save_as_external_data=False)
         print(f"✅ 単一ファイル化完了 (量子化なし)")
     
-    print(f"\n完了! モデルはこちらに保存されました:\n - オリジナル: {output_path}\n - ブラウザ用(推奨): {quant_output_path}")
+    print("4. ブラウザ用バンドル(チャンク分割)を作成中...")
+    manifest_path = build_bundle(quant_output_path, models_dir / "bundle")
+    print(f"✅ バンドル作成完了")
+
+    print(f"\n完了! モデルはこちらに保存されました:\n - オリジナル: {output_path}\n - ブラウザ用(推奨): {quant_output_path}\n - ブラウザ用バンドル: {manifest_path}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,21 +1,117 @@
-// ImageNetのクラスラベル (簡易版)
-const IMAGENET_CLASSES = { 0: "Tench", 1: "Goldfish", /* ...省略、デモ用にIDだけ表示でもOK */ };
+// ImageNetのクラスラベル (サーバーと同じ static/imagenet_classes.json を使う)
+let IMAGENET_CLASSES = [];
+fetch('/imagenet_classes.json')
+    .then(res => res.json())
+    .then(classes => { IMAGENET_CLASSES = classes; })
+    .catch(e => console.error(e));
 
 let wasmSession = null;
 
+// 推論場所アドバイザ用のデバイスクラス (コア数・メモリ量でおおまかに分類)
+const DEVICE_CLASS = `${navigator.hardwareConcurrency || '?'}core-${navigator.deviceMemory || '?'}gb`;
+
+// 計測値をサーバーへ報告 (失敗しても推論には影響させない)
+function reportTiming(fields) {
+    fetch('/api/placement/report', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ device_class: DEVICE_CLASS, ...fields })
+    }).catch(e => console.error(e));
+}
+
 // 1. WASMセッションの初期化 (ページ読み込み時)
 async function initWasm() {
     try {
-        // Quantizedモデルを読み込む
-        wasmSession = await ort.InferenceSession.create('/models/resnet18.quant.onnx', {
-            executionProviders: ['wasm'] // WebAssembly指定
-        });
+        // チャンク分割バンドルがあればそれを使い、なければ単一ファイルを読み込む
+        const model = await loadModelBundle('/models/bundle/resnet18.quant/manifest.json')
+            .catch(e => { console.warn("bundle unavailable, falling back to single file:", e); return null; });
+        const options = { executionProviders: ['wasm'] }; // WebAssembly指定
+        if (model) {
+            wasmSession = await ort.InferenceSession.create(model.graph, { ...options, externalData: model.externalData });
+            // 読み込めたら、今のマニフェストにない古い版のチャンクをキャッシュから消す
+            pruneBundleCache(model.manifest).catch(e => console.warn("bundle cache cleanup failed:", e));
+        } else {
+            // Quantizedモデルを読み込む
+            wasmSession = await ort.InferenceSession.create('/models/resnet18.quant.onnx', options);
+        }
         document.querySelector("#wasmResult").innerHTML = "✅ Model Loaded (Ready)";
     } catch (e) {
         console.error(e);
         document.querySelector("#wasmResult").innerHTML = "❌ Model Load Failed";
     }
 }
+
+// モデルバンドル (scripts/export_browser_bundle.py で生成) を並列ダウンロードして組み立てる
+// チャンクは内容ハッシュ名なので、検証済みのものは Cache Storage に保存して
+// 失敗時の再開や別バージョン間での再利用に使う
+// (キャッシュはこのページが読み込むバンドル専用。不要になったチャンクは pruneBundleCache で消す)
+const BUNDLE_CACHE = 'model-bundle-v1';
+const BUNDLE_CONCURRENCY = 6;
+const BUNDLE_RETRIES = 3;
+
+async function sha256Hex(buffer) {
+    const digest = await crypto.subtle.digest('SHA-256', buffer);
+    return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+}
+
+async function fetchBlob(entry, cache) {
+    const url = `/models/bundle/blobs/${entry.sha256}`;
+    const cached = cache && await cache.match(url);
+    if (cached) return new Uint8Array(await cached.arrayBuffer());
+
+    let lastError;
+    for (let attempt = 0; attempt < BUNDLE_RETRIES; attempt++) {
+        try {
+            const res = await fetch(url);
+            if (!res.ok) throw new Error(`HTTP ${res.status}: ${url}`);
+            const buffer = await res.arrayBuffer();
+            if (await sha256Hex(buffer) !== entry.sha256) {
+                throw new Error(`checksum mismatch: ${url}`);
+            }
+            if (cache) await cache.put(url, new Response(buffer.slice(0)));
+            return new Uint8Array(buffer);
+        } catch (e) {
+            lastError = e;
+        }
+    }
+    throw lastError;
+}
+
+async function loadModelBundle(manifestUrl) {
+    // crypto.subtle は安全なコンテキスト (https / localhost) でのみ使える。
+    // LAN の http でアクセスした場合など、検証できないバンドルは使わず単一ファイルにフォールバックする
+    if (!(window.crypto && crypto.subtle)) {
+        throw new Error("SHA-256 verification unavailable (insecure context)");
+    }
+    const res = await fetch(manifestUrl, { cache: 'no-cache' });
+    if (!res.ok) throw new Error(`HTTP ${res.status}: ${manifestUrl}`);
+    const manifest = await res.json();
+    const cache = ('caches' in window) ? await caches.open(BUNDLE_CACHE).catch(() => null) : null;
+
+    const weights = new Uint8Array(manifest.external_data.size);
+    const queue = [...manifest.chunks];
+    const worker = async () => {
+        while (queue.length) {
+            const chunk = queue.shift();
+            weights.set(await fetchBlob(chunk, cache), chunk.offset);
+        }
+    };
+    const [graph] = await Promise.all([
+        fetchBlob(manifest.graph, cache),
+        ...Array.from({ length: BUNDLE_CONCURRENCY }, worker),
+    ]);
+
+    return { graph, externalData: [{ path: manifest.external_data.path, data: weights }], manifest };
+}
+
+async function pruneBundleCache(manifest) {
+    if (!('caches' in window)) return;
+    const cache = await caches.open(BUNDLE_CACHE);
+    const keep = new Set([manifest.graph, ...manifest.chunks].map(e => `/models/bundle/blobs/${e.sha256}`));
+    for (const request of await cache.keys()) {
+        if (!keep.has(new URL(request.url).pathname)) await cache.delete(request);
+    }
+}
 initWasm();
 
 // 画像アップロード処理
@@ -31,6 +127,7 @@ inputElement.addEventListener('change', (evt) => {
         controlPanel.style.display = 'flex';
         // 結果クリア
         document.getElementById('serverResult').innerText = "";
+        document.getElementById('autoResult').innerText = "";
         // WASMの方はモデルロード済みか確認して表示
         if(wasmSession) document.getElementById('wasmResult').innerText = "✅ Ready";
     }
@@ -54,9 +151,10 @@ async function runServerInference() {
         const data = await res.json();
         const endTime = performance.now();
         const totalLatency = (endTime - startTime).toFixed(2);
+        reportTiming({ network_ms: (endTime - startTime) - data.latency_ms });
 
         uiRes.innerHTML = `
-            ID: ${data.class_id}<br>
+            ID: ${data.class_id} (${data.label})<br>
             Prob: ${data.probability.toFixed(4)}<br>
             <div class="latency">Total Latency: ${totalLatency} ms</div>
             <small>(Net: ${(totalLatency - data.latency_ms).toFixed(2)}ms + Inf: ${data.latency_ms.toFixed(2)}ms)</small>
@@ -75,6 +173,7 @@ async function runWasmInference() {
     
     // 画像をCanvasに描画してピクセルデータ取得 -> Tensor変換
     // ※簡略化のため、画像リサイズ処理などの詳細はデモ用に最適化
+    const prepStart = performance.now();
     const tensor = await imageToTensor(previewElement);
 
     const startTime = performance.now();
@@ -86,6 +185,8 @@ async function runWasmInference() {
 
     const endTime = performance.now();
     const latency = (endTime - startTime).toFixed(2);
+    // サーバー側の計測 (前処理込み) と比べられるよう前処理も含めて報告
+    reportTiming({ wasm_ms: endTime - prepStart });
 
     // 最大値(argmax)を探す
     let maxProb = -Infinity;
@@ -109,13 +210,46 @@ async function runWasmInference() {
     const topProb = probs[maxId];
 
     uiRes.innerHTML = `
-        ID: ${maxId}<br>
+        ID: ${maxId} (${IMAGENET_CLASSES[maxId] ?? "?"})<br>
         Prob: ${topProb.toFixed(4)}<br>
         <div class="latency">Latency: ${latency} ms</div>
         <small>(Network: 0 ms)</small>
     `;
 }
 
+// --- C. Auto (サーバー / WASM をアドバイザに従って選択) ---
+async function runAutoInference() {
+    const uiRes = document.getElementById('autoResult');
+    uiRes.innerText = "Asking advisor...";
+
+    const url = `/api/placement?device_class=${encodeURIComponent(DEVICE_CLASS)}`;
+    let advice;
+    try {
+        const t0 = performance.now();
+        const res = await fetch(url);
+        const rtt = performance.now() - t0;
+        advice = await res.json();
+        // サーバーに通信時間の報告がまだなければ、今の往復時間を渡して見積もり直す
+        if (advice.missing.includes("network_ms")) {
+            advice = await (await fetch(`${url}&rtt_ms=${rtt.toFixed(1)}`)).json();
+        }
+    } catch (e) {
+        uiRes.innerText = "Error";
+        return;
+    }
+
+    const fmt = v => (v === null ? "n/a" : `${v.toFixed(1)} ms`);
+    // モデル未ロードならローカルでは実行できないのでサーバーへ
+    const target = (advice.recommendation === "wasm" && wasmSession) ? "wasm" : "server";
+    uiRes.innerHTML = `
+        → ${target === "wasm" ? "Client (WASM)" : "Server"}<br>
+        <small>expected: server ${fmt(advice.expected_ms.server)} / wasm ${fmt(advice.expected_ms.wasm)}, queue ${advice.queue_depth}</small>
+    `;
+
+    if (target === "wasm") await runWasmInference();
+    else await runServerInference();
+}
+
 // ユーティリティ: HTML Image -> ONNX Tensor (1, 3, 224, 224)
 async function imageToTensor(imgElement) {
     const canvas = document.createElement('canvas');
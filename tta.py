@@ -0,0 +1,83 @@
+"""
+テスト時拡張 (TTA) 用の前処理と集約
+
+app.py と scripts/benchmark_tta.py の両方から使うため、モデルやサーバーに
+依存しない関数だけをここに置く。
+"""
+import torch
+import torchvision.transforms.functional as TF
+from PIL import Image
+
+INPUT_SIZE = 224
+# クロップ系モードでは ImageNet 評価の慣例どおり 256 にリサイズしてから 224 を切り出す
+CROP_RESIZE = 256
+
+# モード名 -> (リサイズ後のサイズ, ビュー数)
+TTA_MODES = {
+    "none": (INPUT_SIZE, 1),        # 従来どおり (224x224 に強制リサイズ)
+    "center": (CROP_RESIZE, 1),     # センタークロップ
+    "flip": (CROP_RESIZE, 2),       # センタークロップ + 左右反転
+    "five_crop": (CROP_RESIZE, 5),  # 四隅 + 中央
+    "ten_crop": (CROP_RESIZE, 10),  # five_crop + 左右反転
+}
+
+# five_crop の四隅は画像の端まで使うため、keep_aspect 時も長辺:短辺をこの比率までに抑える
+# (極端な縦横比の画像で長辺が際限なく大きなテンソルにならないようにする)
+MAX_ASPECT = 4.0
+
+_MEAN = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)
+_STD = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
+
+
+def _crop_long_side(image: Image.Image, max_aspect: float) -> Image.Image:
+    """長辺が短辺の max_aspect 倍を超える部分を中央で切り落とす"""
+    width, height = image.size
+    short = min(width, height)
+    limit = max(1, int(short * max_aspect))
+    if max(width, height) <= limit:
+        return image
+    new_w, new_h = min(width, limit), min(height, limit)
+    left, top = (width - new_w) // 2, (height - new_h) // 2
+    return image.crop((left, top, left + new_w, top + new_h))
+
+
+def build_views(image: Image.Image, mode: str = "none", keep_aspect: bool = False) -> torch.Tensor:
+    """画像から TTA 用のビューをまとめて生成し (N, 3, 224, 224) の正規化済みバッチを返す
+
+    リサイズと ToTensor は 1 回だけ行い、クロップはテンソルのスライス、
+    反転と正規化はバッチ全体に対して一括で適用する。
+    """
+    if mode not in TTA_MODES:
+        raise ValueError(f"unknown TTA mode: {mode}")
+    resize_size, _ = TTA_MODES[mode]
+
+    # keep_aspect=True なら短辺を合わせる (アスペクト比維持)、False なら強制リサイズ
+    if keep_aspect:
+        # クロップで使う範囲だけをリサイズ・テンソル化する (中央系モードは中央の正方形のみ)
+        max_aspect = MAX_ASPECT if mode in ("five_crop", "ten_crop") else 1.0
+        image = _crop_long_side(image, max_aspect)
+        size = resize_size
+    else:
+        size = (resize_size, resize_size)
+    base = TF.to_tensor(TF.resize(image, size))
+
+    if mode in ("five_crop", "ten_crop"):
+        views = torch.stack(TF.five_crop(base, [INPUT_SIZE, INPUT_SIZE]))
+    else:
+        views = TF.center_crop(base, [INPUT_SIZE, INPUT_SIZE]).unsqueeze(0)
+
+    if mode in ("flip", "ten_crop"):
+        views = torch.cat([views, views.flip(-1)])
+
+    return (views - _MEAN) / _STD
+
+
+def aggregate_logits(logits: torch.Tensor) -> torch.Tensor:
+    """ビューごとの logits (N, C) を平均して (C,) にまとめる"""
+    return logits.mean(dim=0)
+
+
+def topk_predictions(probabilities: torch.Tensor, k: int = 1):
+    """softmax 確率 (C,) の上位 k 件を [(class_id, prob), ...] で返す"""
+    top_probs, top_ids = torch.topk(probabilities, min(k, probabilities.numel()))
+    return [(int(i), float(p)) for i, p in zip(top_ids, top_probs)]